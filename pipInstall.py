@@ -37,6 +37,8 @@ Try to install unless:
            prevents accidental breaking of another plugin
            can be over-ridden by supplying version info
         4. If installed version >= requested version ==> do nothing 
+    If installing into a virtual environment
+        5. If a version is given and the installed version meets it ==> do nothing
 
 Note: If a module is already installed but failes reinstall / update
       The occurence is logged and the install request is considered successful        
@@ -62,14 +64,48 @@ Improved logging
 import subprocess
 import sys
 import logging
-from pkg_resources import parse_version as version
 import re
 import os
 import sysconfig
+import operator
+from collections import deque
+import importlib.util
+import importlib.metadata
 
 # Configuration Variables
 pluginPath = '/opt/dsf/plugins'
 pythonVersion = 'python'  #Possible future use with additional input of specific version
+STREAM_TAIL = 200  # Lines of output kept by streamsubprocess
+PIP_OPTIONS = ['--disable-pip-version-check', '--no-input']  # No version check network call or prompts
+
+# Compiled once - used for every request
+CANONICAL_TABLE = str.maketrans('-.', '__')  # Single pass canonical name
+# The name cannot contain a conditional character so there is one way to match - no backtracking
+CONDITIONAL_REGEX = re.compile('(?P<name>[^=~<>]+)(?P<compare>' + '|'.join(['==', '~=', '>=', '<=', '>', '<']) + ')(?P<version>.+)')
+
+# Modules that never need installing - set lookup, no import needed
+BUILT_INS = frozenset(sys.builtin_module_names) | getattr(sys, 'stdlib_module_names', frozenset())
+
+# Test for each conditional - ~= is converted to >= by parseVersion
+COMPARES = {'==': operator.eq, '>=': operator.ge, '<=': operator.le, '>': operator.gt, '<': operator.lt}
+
+# Run by the venv python - prints the installed version of a module, Built-In or None
+# A module in the venv shadows the system copy so only the venv python can tell
+# Package names are matched the same way pip does
+VENV_TEST = '''import sys
+from importlib.metadata import version, PackageNotFoundError
+m = sys.argv[1]
+try:
+    result = version(m) # From the package metadata - nothing is imported
+except PackageNotFoundError:
+    try:
+        result = __import__(m).__version__
+    except AttributeError: # No version number
+        result = 'Built-In'
+    except Exception: # Not importable
+        result = 'None'
+print(result)
+'''
 
 def createLogger(logname):   ##### Create a custom logger so messages go to journalctl#####
     global logger
@@ -85,7 +121,7 @@ def createLogger(logname):   ##### Create a custom logger so messages go to jour
 def validateArguments():
     numArgs = len(sys.argv)
     if numArgs <= 1:
-        logger.info('No module was specified: ' + str(sys.argv))
+        logger.info('No module was specified: %s', sys.argv)
         sys.exit(1)
     elif numArgs == 2:
         # Need 3 arguments for externally managed environments
@@ -99,51 +135,64 @@ def validateArguments():
         reqVersion = sys.argv[1]
         pName  = sys.argv[2]
     elif numArgs > 3:
-        logger.info('Too many arguments.' + str(sys.argv))
+        logger.info('Too many arguments.%s', sys.argv)
         sys.exit(1)
     return  reqVersion, pName
 
 def parseVersion(request):
 # Get the module name any conditional and version
     if ',' in request:
-        logger.info('Unsupported Conditional in: ' + str(request))
+        logger.info('Unsupported Conditional in: %s', request)
         sys.exit(1)
 
-    result = []
-    conditionals = '|'.join(['==', '~=', '>=', '<=', '>', '<'])
-    regex = '(.+)(' + conditionals + ')(.+)'
-    result = re.findall(regex,request)
+    result = CONDITIONAL_REGEX.match(request)
 
-    if len(result) == 0: # No conditional
-        result = [(request, '', '')]
+    if result is None: # No conditional
+        return request, '', ''
 
-    result = list(result[0]) # Convert tuple to list
-    if result[1] == '~=':
-        result [1] = '>='
-    return result[0], result[1], result[2]
+    mCompare = result.group('compare')
+    if mCompare == '~=':
+        mCompare = '>='
+    return result.group('name'), mCompare, result.group('version')
 
 def runsubprocess(cmd):
+    # cmd is a list of arguments - no shell is used
     try:
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True, shell=True)
-        if result.returncode != 0:
-            if str(result.stderr) != '' and '[Error]' in str(result.stderr):
-                logger.info('Command Failure: ' + str(cmd))
-                logger.debug('Error = ' + str(result.stderr))
-                logger.debug('Output = ' + str(result.stdout))
-                return False
-        return result.stdout
+        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+        return result.stdout # A non zero return code raises CalledProcessError
     except subprocess.CalledProcessError as e1:
-        logger.info('ProcessError -- ' + str(e1))
+        logger.info('ProcessError -- %s', e1)
+    except OSError as e2:
+        logger.info('OSError -- %s', e2)
+    return False
+
+def streamsubprocess(cmd):
+    # For commands with a lot of output e.g. pip install
+    # Output is logged line by line rather than held in memory
+    # Only the last STREAM_TAIL lines are kept - for reporting a failure
+    # Returns True if the command succeeded
+    try:
+        with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1) as p:
+            tail = deque(maxlen=STREAM_TAIL)
+            for line in p.stdout:
+                line = line.rstrip()
+                logger.debug(line)
+                tail.append(line)
+            if p.wait() == 0:
+                return True
+        # Summarise with the last error reported
+        errors = [line for line in tail if line.startswith('ERROR')] or ['']
+        logger.info('Command Failure: %s -- %s', ' '.join(cmd), errors[-1])
     except OSError as e2:
-        logger.info('OSError -- ' + str(e2))
+        logger.info('OSError -- %s', e2)
     return False
 
 def createPythonEnv(envPath):
     if os.path.exists(envPath+'/bin/' + pythonVersion): # No need to recreate
         return
 
-    cmd = pythonVersion + ' -m venv --system-site-packages  ' + envPath
-    logger.info('Creating Python Virtual Environment at: ' + envPath)
+    cmd = [pythonVersion, '-m', 'venv', '--system-site-packages', envPath]
+    logger.info('Creating Python Virtual Environment at: %s', envPath)
     result = runsubprocess(cmd)
     if result != '':
         logger.info ('Problem creating Virtual Environment')
@@ -156,55 +205,68 @@ def getInstalledVersion(m,envPath ):
     # If installed but no version number return 0
     # If not installed return -1
     # If a built-in return ''
-    try:
-        globals()[m] = __import__(m)  #Will likely not work if alternate python versions allowed in future
-        result = globals()[m].__version__
-        #logger.info('System Version is: ' + result)
-        return result
-
-    except AttributeError: # No version number
+    if m in BUILT_INS:
         return 'Built-In'
 
-    except ImportError: #  Check to see if pip thinks its installed
-        if envPath == '':
-            cmd = 'python -m pip list'
-        else:
-            cmd = envPath + '/bin/' + pythonVersion + ' -m pip list'
-
+    if envPath != '': # Ask the venv python
+        cmd = [envPath + '/bin/' + pythonVersion, '-c', VENV_TEST, m]
         request = runsubprocess(cmd)
         if request is False:
-            logger.info('Aborting: Failed to get pip list')
+            logger.info('Aborting: Failed to read package metadata')
             sys.exit(1)
-        # Normalise to lower case and underscore
-        request = request.lower()
-        request = request.replace('-','_')
-
-        if m in request: #  The module exists
-            # Try to get version number
-            regex = '^'+ m + '\s+(.*)'
-            result = re.findall(regex,request,flags=re.MULTILINE)
-            if result[0] != '': # version number found
-                return result[0]
-            # Module found but no version number available
-            return '0'
-        else:
-            return 'None'
+        return request.strip()
+
+    try:
+        return importlib.metadata.version(m)  # Reads the package metadata only
+    except importlib.metadata.PackageNotFoundError: # e.g. import name differs from the package name
+        pass
+
+    try:
+        spec = importlib.util.find_spec(m)  # Finds the module without running it
+    except (ImportError, ValueError):
+        spec = None
+    if spec is None:
+        return 'None'
 
+    try:
+        module = importlib.import_module(m)  #Will likely not work if alternate python versions allowed in future
+    except ImportError:
+        return 'None'
+    result = getattr(module, '__version__', 'Built-In') # Built-In if no version number
+    #logger.info('System Version is: %s', result)
+    return result
+
+
+def versionSatisfied(installedVersion, mCompare, mVersion):
+    # True if the installed version already meets the requested version
+    if mCompare not in COMPARES or installedVersion in ['Built-In', 'None', '0']:
+        return False
+    # Only imported if a comparison is needed - packaging avoids the slow pkg_resources import
+    try:
+        from packaging.version import Version as version
+    except ImportError:
+        try:
+            from pkg_resources import parse_version as version
+        except ImportError: # No version parser available - let pip decide
+            return False
+    try:
+        installed = version(installedVersion)
+        requested = version(mVersion)
+    except Exception: # Not a comparable version number
+        return False
+
+    return COMPARES[mCompare](installed, requested)
 
 def installModule(mRequest, mVersion, envPath):
-    upgrade = ''
-    if mVersion == '':
-        upgrade = ' --upgrade '
     if envPath == '':
-        cmd = pythonVersion + ' -m pip install --no-cache-dir ' + upgrade +  '"' + mRequest + '"' 
+        cmd = [pythonVersion, '-m', 'pip'] + PIP_OPTIONS + ['install', '--no-cache-dir']
     else:
-        cmd = envPath + '/bin/'+ pythonVersion + ' -m pip install --no-cache-dir ' + upgrade +  '"' + mRequest + '"' 
-
-    result = runsubprocess(cmd)
-    if result == False:  # module could not be installed
-        return False
+        cmd = [envPath + '/bin/'+ pythonVersion, '-m', 'pip'] + PIP_OPTIONS + ['install', '--no-cache-dir']
+    if mVersion == '':
+        cmd.append('--upgrade')
+    cmd.append(mRequest)
 
-    return True
+    return streamsubprocess(cmd) # False if the module could not be installed
 
 def main(progName):
     # Set up logging so journalc can be used
@@ -212,11 +274,6 @@ def main(progName):
 
     #  Validate that the call was well formed and get the arguments
     requestedVersion, pluginName = validateArguments()
-    # Change ro canonical name
-    requestedVersion = requestedVersion.lower()
-    requestedVersion = requestedVersion.replace('.','_')
-    requestedVersion = requestedVersion.replace('-','_')
-
     if pluginName != '':
         #setup python virtual environment
         venvPath = pluginPath + '/' + pluginName + '/venv'
@@ -226,17 +283,19 @@ def main(progName):
 
     # Get the elements of the requested module - parseVersion may modify
     mName, mCompare, mVersion = parseVersion(requestedVersion)
+    # Change to canonical name - the version number is left as given
+    mName = mName.lower().translate(CANONICAL_TABLE)
     mRequested = mName+mCompare+mVersion
 
-    logger.info('Checking for python module: ' + mRequested)
+    logger.info('Checking for python module: %s', mRequested)
     if pluginName == '':
         logger.info('in System Environment')
     else:
-        logger.info('in Virtual Environment: ' + venvPath)
+        logger.info('in Virtual Environment: %s', venvPath)
 
     # Check to see what is installed
     installedVersion = getInstalledVersion(mName, venvPath)
-    logger.info('Currently installed: '+ installedVersion)
+    logger.info('Currently installed: %s', installedVersion)
 
     #  Determine next action according to Rules
     #  Positionally sensitive
@@ -250,7 +309,7 @@ def main(progName):
         elif mVersion == '':               # Rule 3
             resultCode = 0
             tryInstall = False
-        elif version(installedVersion) >= version(mVersion):
+        elif versionSatisfied(installedVersion, '>=', mVersion):
             resultCode = 0                 # Rule 4
             tryInstall = False
 
@@ -258,6 +317,9 @@ def main(progName):
         if installedVersion == 'Built-In': # Rule 1
             resultCode = 2
             tryInstall = False
+        elif versionSatisfied(installedVersion, mCompare, mVersion): # Rule 5
+            resultCode = 0
+            tryInstall = False
 
     if tryInstall:
         installOk = installModule(mRequested, mVersion, venvPath)
@@ -273,17 +335,17 @@ def main(progName):
         logger.info('Module already installed')
         sys.exit(0) #Success
     elif resultCode == 1:
-        logger.info('Module ' + mName + ' was installed or updated to version ' +  getInstalledVersion(mName, venvPath))
+        logger.info('Module %s was installed or updated to version %s', mName, getInstalledVersion(mName, venvPath))
         sys.exit(0) #Success
     elif resultCode == 2:
         logger.info('Module is a built-in. Nothing to install.')
         sys.exit(0) #Success
     elif resultCode == 3:
-        logger.info('Module ' + mRequested + ' could not be installed.')
+        logger.info('Module %s could not be installed.', mRequested)
         logger.info('Check the module name and version number(if provided).')
         sys.exit(1)
     elif resultCode == 4:
-        logger.info('Unable to update module: Still at version ' + installedVersion)
+        logger.info('Unable to update module: Still at version %s', installedVersion)
     else:
         logger.info('An unexpected error occured')
         sys.exit(1)
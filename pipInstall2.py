@@ -24,13 +24,26 @@ If version number is supplied it must use one of the following comparisons:
 
 Version numbers specifying max / min ranges are not supported
 
+If the manifest entries include --no-deps it is passed to pip and
+dependencies of the listed modules are not resolved or installed
+(for manifests that already list every module needed)
+
 Rules (executed in order):
 Try to install unless:
         1. If the module is a Built-In ==> do nothing
+        2. If a version is given and the installed version meets it ==> do nothing
 
 Note: If a module is already installed but failes reinstall / update
       The occurence is logged and the install request is considered successful        
 
+Note: If the manifest is unchanged since the last successful install into the
+      virtual environment (same python, python version and platform) and no
+      module has been installed or removed since, the previous results are
+      reported and nothing is installed.
+      This is checked from the modification times of the venv and system
+      site-packages folders without running pip.  If those have changed
+      pip list is compared with the last install instead
+
 Return Codes:
 
 0 - All modules successfully installed or already installed.
@@ -45,24 +58,88 @@ Initial Release
 import subprocess
 import sys
 import logging
-from pkg_resources import parse_version as version
 import re
 import os
 import sysconfig
+import site
 import argparse
 import json
+import hashlib
+import platform
+import operator
+import venv
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+try:
+    import orjson  # Faster json parsing if available
+except ImportError:
+    orjson = None
 
 # CONSTANTS
 VENV_FOLDER = 'venv'
 MANIFEST_KEY = 'sbcPythonDependencies'
-PIP = 'pip'
+MANIFEST_OPTIONS = ['--no-deps']  # pip options that can be given as manifest entries
+PIP_FILE = 'pip_run.py'
+IMPORT_TEST_FILE = 'import_test.py'
+INSTALL_CACHE_FILE = '.pipinstall_cache.json'
+PROBE_WORKERS = min(8, os.cpu_count() or 2)  # Max parallel import tests
+PROBE_CHUNK = 4  # Min modules per import test
+INSTALL_WORKERS = min(8, os.cpu_count() or 2)  # Max parallel pip dry runs
+STREAM_TAIL = 200  # Lines of output kept by streamsubprocess
+PIP_OPTIONS = ['--disable-pip-version-check', '--no-input']  # No version check network call or prompts
+
+pipListCache = {} # venv path : pip list - see getPipList
+
+# Compiled once - used for every module in the manifest
+# The name cannot contain a conditional character so there is one way to match - no backtracking
+CONDITIONAL_REGEX = re.compile('(?P<name>[^=~<>]+)(?P<compare>' + '|'.join(['==', '~=', '>=', '<=', '>', '<']) + ')(?P<version>.+)')
+CANONICAL_REGEX = re.compile('[-_.]+')  # pip treats these as equivalent
+
+# Test for each conditional - ~= is converted to >= by parseVersion
+COMPARES = {'==': operator.eq, '>=': operator.ge, '<=': operator.le, '>': operator.gt, '<': operator.lt}
+
+# Modules that never need installing - set lookup, no import test needed
+BUILT_INS = frozenset(sys.builtin_module_names) | getattr(sys, 'stdlib_module_names', frozenset())
+
+# Log entry for each resultCode - 3 is a failure
+RESULT_MESSAGES = {0: 'Module "{request}" is already installed',
+                   1: 'Module "{name}" was installed or updated to version {updated}',
+                   2: 'Module "{name}" is a built-in.',
+                   3: 'Module "{request}"',
+                   4: 'Module "{name}" was not updated from version {installed}'}
+
+# Run by the venv python with module names as arguments
+# Prints one line per module:  <module name>|<version>
+IMPORT_TEST = '''import sys
+from importlib.metadata import version, PackageNotFoundError
+for m in sys.argv[1:]:
+    try:
+        result = version(m) # From the package metadata - nothing is imported
+    except PackageNotFoundError:
+        try:
+            result = __import__(m).__version__
+        except AttributeError: # No version number
+            result = 'Built-In'
+        except Exception: # Not importable
+            result = 'None'
+    print(m + '|' + str(result))
+'''
+
+# Run by the venv python in place of -m pip (avoids the runpy overhead)
+PIP_RUN = '''import sys
+from pip._internal.cli.main import main
+sys.exit(main(sys.argv[1:]))
+'''
 
 if os.name == 'nt': # Windows
     BIN_DIR = 'Scripts'
     PYTHON_VERSION = 'python.exe'
+    PIP_CACHE_DIR = '' # Use the pip default
 else:
     BIN_DIR = 'bin'
     PYTHON_VERSION = 'python'
+    PIP_CACHE_DIR = '/opt/dsf/sd/pip_cache' # Downloads shared by all plugins
 
 
 def createLogger(logname):   ##### Create a custom logger so messages go to journalctl#####
@@ -94,212 +171,437 @@ def validateParams():
         logger.info('Exiting: No manifest file (-m) was provided')
         sys.exit(1)
     elif not os.path.isfile(mFile):
-        logger.info('Exiting: Manifest file ' +mFile + ' does not exist')
+        logger.info('Exiting: Manifest file %s does not exist', mFile)
         sys.exit(1)
 
     if pPath is None:
         logger.info('Exiting: No plugin path (-p) was provided')
         sys.exit(1)
     elif not os.path.isdir(pPath):    
-        logger.info('Exiting: Manifest file ' +mFile + 'does not exist')
+        logger.info('Exiting: Manifest file %sdoes not exist', mFile)
         sys.exit(1)
         
     return mFile, pPath
 
+@dataclass
+class ModuleRequest:
+    name: str                  # Canonical module name
+    compare: str               # Conditional e.g. >= or '' if none
+    version: str               # Requested version or '' if none
+    installedVersion: str = ''
+    resultCode: int = None     # None until the next action is known
+
+    @property
+    def request(self):  # As passed to pip
+        return self.name + self.compare + self.version
+
 def parseVersion(request):
 # Get the module name any conditional and version
     if ',' in request:
-        logger.info('Unsupported Conditional in: ' + str(request))
+        logger.info('Unsupported Conditional in: %s', request)
         sys.exit(1)
 
-    result = []
-    conditionals = '|'.join(['==', '~=', '>=', '<=', '>', '<'])
-    regex = '(.+)(' + conditionals + ')(.+)'
-    result = re.findall(regex,request)
+    result = CONDITIONAL_REGEX.match(request)
+
+    if result is None: # No conditional
+        return request, '', ''
 
-    if len(result) == 0: # No conditional
-        result = [(request, '', '')]
+    mCompare = result.group('compare')
+    if mCompare == '~=':
+        mCompare = '>='
+    return result.group('name'), mCompare, result.group('version')
 
-    result = list(result[0]) # Convert tuple to list
-    if result[1] == '~=':
-        result [1] = '>='
-    return result[0], result[1], result[2]
+# Subprocess notes:
+# No preexec_fn, cwd or start_new_session and close_fds=False lets CPython use
+# posix_spawn (cheaper than fork + exec) when the command is a full path.
+# This is safe because python file descriptors are not inheritable by default.
 
 def runsubprocess(cmd):
+    # cmd is a list of arguments - no shell is used
     try:
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True, shell=True)
-        if result.returncode != 0:
-            if str(result.stderr) != '' and '[Error]' in str(result.stderr):
-                logger.info('Command Failure: ' + str(cmd))
-                logger.debug('Error = ' + str(result.stderr))
-                logger.debug('Output = ' + str(result.stdout))
-                return False
-        return result.stdout
+        result = subprocess.run(cmd, capture_output=True, text=True, check=True, close_fds=False)
+        return result.stdout # A non zero return code raises CalledProcessError
     except subprocess.CalledProcessError as e1:
         pass
-        #logger.info('ProcessError -- ' + str(e1))  #  Supress this error 
+        #logger.info('ProcessError -- %s', e1)  #  Supress this error 
+    except OSError as e2:
+        logger.info('OSError -- %s', e2)
+    return False
+
+def streamsubprocess(cmd):
+    # For commands with a lot of output e.g. pip install
+    # Output is logged line by line rather than held in memory
+    # Only the last STREAM_TAIL lines are kept - for reporting a failure
+    # Returns True if the command succeeded
+    try:
+        with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1, close_fds=False) as p:
+            tail = deque(maxlen=STREAM_TAIL)
+            for line in p.stdout:
+                line = line.rstrip()
+                logger.debug(line)
+                tail.append(line)
+            if p.wait() == 0:
+                return True
+        # Summarise with the last error reported
+        errors = [line for line in tail if line.startswith('ERROR')] or ['']
+        logger.info('Command Failure: %s -- %s', ' '.join(cmd), errors[-1])
     except OSError as e2:
-        logger.info('OSError -- ' + str(e2))
+        logger.info('OSError -- %s', e2)
     return False
 
-def createPythonEnv(envPath):
-    pythonFile = os.path.normpath(os.path.join(envPath,BIN_DIR,PYTHON_VERSION))
-    if os.path.isfile(pythonFile): # No need to recreate
+def getVenvFiles(envPath):
+    # Full paths of the files used in the venv - built once by main and passed down
+    return {'path': envPath,
+            'python': os.path.normpath(os.path.join(envPath,BIN_DIR,PYTHON_VERSION)),
+            'pip': os.path.normpath(os.path.join(envPath,PIP_FILE)),
+            'importTest': os.path.normpath(os.path.join(envPath,IMPORT_TEST_FILE)),
+            'cache': os.path.normpath(os.path.join(envPath,INSTALL_CACHE_FILE))}
+
+def createPythonEnv(venvFiles):
+    envPath = venvFiles['path']
+    if os.path.isfile(venvFiles['python']): # No need to recreate
         return
 
-    cmd = PYTHON_VERSION + ' -m venv --system-site-packages  ' + envPath
-    logger.info('Creating Python Virtual Environment at: ' + envPath)
-    result = runsubprocess(cmd)
-    if result != '':
+    # Same as python -m venv --system-site-packages but without starting another python
+    logger.info('Creating Python Virtual Environment at: %s', envPath)
+    try:
+        builder = venv.EnvBuilder(system_site_packages=True, with_pip=True, symlinks=(os.name != 'nt'))
+        builder.create(envPath)
+    except (OSError, subprocess.CalledProcessError) as e:
         logger.info ('Problem creating Virtual Environment')
-        logger.info(result)
+        logger.info('%s', e)
         sys.exit(1)
     return
 
-def getModuleList(mFile):
-    with open(mFile) as jsonfile:
+def readManifest(mFile):
+    # The manifest is read once and the contents shared
+    with open(mFile, 'rb') as f:
+        return f.read()
+
+def getInstallKey(manifest, pythonFile):
+    # Identifies the manifest contents, python version, platform and the python used by the venv
+    content = manifest + sys.version.encode() + platform.machine().encode() + os.path.realpath(pythonFile).encode()
+    return hashlib.sha256(content).hexdigest()
+
+def getSiteStamp(venvFiles):
+    # Modification times of the venv and system site-packages folders
+    # These change when a module is installed or removed - checked without running pip
+    scheme = 'venv' if 'venv' in sysconfig.get_scheme_names() else ('nt' if os.name == 'nt' else 'posix_prefix')
+    envPath = venvFiles['path']
+    sitePaths = [sysconfig.get_path('purelib', scheme, vars={'base': envPath, 'platbase': envPath})] + site.getsitepackages()
+    stamp = []
+    for sitePath in sitePaths:
         try:
-            config = json.load(jsonfile)
-        except ValueError as e:
-            logger.info(mFile + ' is not a properly formatted json file')
-            logger.info(str(e))
-            exit(1)
-
-    mList = config[MANIFEST_KEY]
+            stamp.append(os.stat(sitePath).st_mtime_ns)
+        except OSError: # Does not exist
+            stamp.append(0)
+    return stamp
+
+def readInstallCache(venvFiles):
+    # Results of the last successful install - {} if there are none
+    # {'key': install key, 'siteStamp': site stamp after install, 'pipList': pip list after install, 'results': success list}
+    try:
+        with open(venvFiles['cache']) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def writeInstallCache(venvFiles, installCache):
+    cacheFile = venvFiles['cache']
+    if len(installCache) == 0: # Forget the last install
+        if os.path.isfile(cacheFile):
+            os.remove(cacheFile)
+        return
+    with open(cacheFile, 'w') as f:
+        json.dump(installCache, f)
 
-    return mList
+def loadJson(data):
+    # Raises ValueError (orjson.JSONDecodeError is a subclass) if not valid json
+    if orjson is None:
+        return json.loads(data)
+    return orjson.loads(data)
 
-def getInstalledVersion(m,envPath ):
+def getModuleList(mFile, manifest):
     try:
-        globals()[m] = __import__(m)  #Will likely not work if alternate python versions allowed in future
-        result = globals()[m].__version__
-        return result
+        config = loadJson(manifest)
+    except ValueError as e: # Includes orjson.JSONDecodeError
+        logger.info('%s is not a properly formatted json file', mFile)
+        logger.info('%s', e)
+        exit(1)
 
-    except AttributeError: # No version number
-        return 'Built-In'
+    mList = config[MANIFEST_KEY]
 
-    except ImportError: #  Check to see if pip thinks its installed
-        pythonFile = os.path.normpath(os.path.join(envPath,BIN_DIR,PYTHON_VERSION))
-        cmd = pythonFile + ' -m ' + PIP + ' list'
+    return mList
 
-        request = runsubprocess(cmd)
-        if request is False:
-            logger.info('Aborting: Failed to get pip list')
-            sys.exit(1)
-        # Normalise to lower case and underscore
-        request = request.lower()
-        request = request.replace('-','_')
-
-        if m in request: #  The module exists
-            # Try to get version number
-            regex = '^'+ m + '\s+(.*)'
-            result = re.findall(regex,request,flags=re.MULTILINE)
-            if result[0] != '': # version number found
-                return result[0]
-            # Module found but no version number available
-            return '0'
+def createVenvFiles(venvFiles):
+    # Helper scripts run by the venv python
+    for helperFile, content in [(venvFiles['importTest'], IMPORT_TEST), (venvFiles['pip'], PIP_RUN)]:
+        with open(helperFile, 'w') as f:
+            f.write(content)
+
+def pipCommand(venvFiles, args):
+    # pip command line for the venv
+    return [venvFiles['python'], venvFiles['pip']] + PIP_OPTIONS + args
+
+def getInstalledVersions(mNames, venvFiles):
+    # Probes the modules with as few calls to the venv python as possible
+    # Returns a dict of module name : version
+    versions = {}
+    probe = []
+    for m in dict.fromkeys(mNames): # Each module is only probed once
+        if m in BUILT_INS:
+            versions[m] = 'Built-In'
         else:
-            return 'None'
+            probe.append(m)
+
+    if len(probe) > 0:
+        # Larger manifests are split so that slow imports run in parallel
+        workers = min(PROBE_WORKERS, (len(probe) + PROBE_CHUNK - 1) // PROBE_CHUNK)
+        cmds = [[venvFiles['python'], venvFiles['importTest']] + probe[i::workers] for i in range(workers)]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(runsubprocess, cmds))
+
+        for request in results:
+            if request is False:
+                logger.info('Aborting: Failed to run import test')
+                sys.exit(1)
+            for line in request.splitlines():
+                m, _, result = line.partition('|')
+                versions[m] = result
+
+    missing = [m for m in mNames if versions.get(m, 'None') == 'None']
+    if len(missing) > 0: #  Check to see if pip thinks they are installed
+        pipList = getPipList(venvFiles)
+        for m in missing:
+            versions[m] = pipList.get(m, 'None')
+
+    return versions
+
+def getPipList(venvFiles):
+    # Returns a dict of module name : version for everything pip has installed
+    # pip is only run the first time it is needed and again after an install
+    if venvFiles['path'] in pipListCache:
+        return pipListCache[venvFiles['path']]
+
+    cmd = pipCommand(venvFiles, ['list', '--format=json'])
+
+    request = runsubprocess(cmd)
+    if request is False:
+        logger.info('Aborting: Failed to get pip list')
+        sys.exit(1)
 
+    try:
+        modules = loadJson(request) # [{'name': name, 'version': version}, ...]
+    except ValueError:
+        logger.info('Aborting: Could not read pip list')
+        sys.exit(1)
 
-def installModule(mRequest, mVersion, envPath):
-    upgrade = ''
-    if mVersion == '':
-        upgrade = ' --upgrade '
-    pythonFile = os.path.normpath(os.path.join(envPath,BIN_DIR,PYTHON_VERSION))
-    cmd = pythonFile + ' -m ' + PIP + ' install --no-cache-dir ' + upgrade +  '"' + mRequest + '"' 
+    # Normalise to lower case and underscore
+    pipList = {CANONICAL_REGEX.sub('_', module['name'].lower()): module['version'] for module in modules}
+    pipListCache[venvFiles['path']] = pipList
+    return pipList
 
-    result = runsubprocess(cmd)
-    if result == False:  # module could not be installed
-        return False
 
-    return True
+def versionSatisfied(installedVersion, mCompare, mVersion):
+    # True if the installed version already meets the requested version
+    if mCompare not in COMPARES or installedVersion in ['Built-In', 'None', '0']:
+        return False
+    # Only imported if a comparison is needed - packaging avoids the slow pkg_resources import
+    try:
+        from packaging.version import Version as version
+    except ImportError:
+        try:
+            from pkg_resources import parse_version as version
+        except ImportError: # No version parser available - let pip decide
+            return False
+    try:
+        installed = version(installedVersion)
+        requested = version(mVersion)
+    except Exception: # Not a comparable version number
+        return False
 
-def installModules(mList,envPath):
+    return COMPARES[mCompare](installed, requested)
+
+def installModule(mRequests, pipOptions, venvFiles, dryRun=False):
+    # Installs one or more modules with a single call to pip
+    # pipOptions e.g. --upgrade are added to the pip command
+    # dryRun only checks that pip could install them
+    cmd = pipCommand(venvFiles, ['install'] + pipOptions)
+    if PIP_CACHE_DIR != '':
+        cmd.extend(['--cache-dir', PIP_CACHE_DIR])
+    if dryRun:
+        cmd.append('--dry-run')
+    else:
+        cmd.append('--no-compile') # see compileModules
+        pipListCache.pop(venvFiles['path'], None) # No longer current
+    cmd.extend(mRequests)
+
+    return streamsubprocess(cmd) # False if one or more modules could not be installed
+
+def installBatch(batch, pipOptions, venvFiles):
+    # Returns the ModuleRequests in the batch that were installed
+    if installModule([mRequest.request for mRequest in batch], pipOptions, venvFiles):
+        return batch
+    if len(batch) == 1:
+        return []
+
+    # pip installs all or nothing so find the failures
+    # Dry runs do not change the venv so they can run in parallel
+    workers = min(INSTALL_WORKERS, len(batch))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        checks = list(executor.map(lambda mRequest: installModule([mRequest.request], pipOptions, venvFiles, True), batch))
+
+    installed = [mRequest for mRequest, ok in zip(batch, checks) if ok]
+    if len(installed) > 0 and not installModule([mRequest.request for mRequest in installed], pipOptions, venvFiles):
+        installed = []
+        checks = [False] * len(batch)
+    # Confirm the failures (e.g. older pip without --dry-run)
+    for mRequest, ok in zip(batch, checks):
+        if not ok and installModule([mRequest.request], pipOptions, venvFiles):
+            installed.append(mRequest)
+    return installed
+
+def compileModules(venvFiles):
+    # pip installs with --no-compile so that everything installed is
+    # byte compiled once, in parallel.  Files that are up to date are skipped
+    cmd = [venvFiles['python'], '-m', 'compileall', '-q', '-j', '0', venvFiles['path']]
+    if runsubprocess(cmd) is False:
+        logger.info('Some installed files could not be compiled')
+
+def installModules(mList,venvFiles):
     sList = [] # Success 
     fList = [] # Fail
+    mRequests = []
+    # pip options given as manifest entries apply to every install
+    manifestOptions = [entry for entry in mList if entry in MANIFEST_OPTIONS]
     for requestedVersion in mList:
+        if requestedVersion in MANIFEST_OPTIONS:
+            continue
         # Get the elements of the requested module - parseVersion may modify
         mName, mCompare, mVersion = parseVersion(requestedVersion)
         # Change to canonical name
-        mName = mName.lower()
-        mName = mName.replace('-','_')
-        mName = mName.replace('.','_')
-        mRequested = mName+mCompare+mVersion
+        mName = CANONICAL_REGEX.sub('_', mName.lower())
+        mRequest = ModuleRequest(mName, mCompare, mVersion)
 
-        logger.info('Checking for python module: ' + mRequested)
+        logger.info('Checking for python module: %s', mRequest.request)
+        mRequests.append(mRequest)
 
-        # Check to see what is installed
-        installedVersion = getInstalledVersion(mName, envPath)
+    # Check to see what is installed
+    installedVersions = getInstalledVersions([mRequest.name for mRequest in mRequests], venvFiles)
 
+    for mRequest in mRequests:
+        mRequest.installedVersion = installedVersions[mRequest.name]
         #  Determine next action
-        if installedVersion == 'Built-In': # Rule 1
-            resultCode = 2
-        else:
-            installOk = installModule(mRequested, mVersion, envPath)
-            if installOk:
-                resultCode = 1
-            elif installedVersion not in ['Built_in','None']:
-                resultCode = 4
+        if mRequest.installedVersion == 'Built-In': # Rule 1
+            mRequest.resultCode = 2
+        elif versionSatisfied(mRequest.installedVersion, mRequest.compare, mRequest.version): # Rule 2
+            mRequest.resultCode = 0
+
+    # Install in two batches.  Modules without a version are upgraded
+    toInstall = [mRequest for mRequest in mRequests if mRequest.resultCode is None]
+    for upgrade in [True, False]:
+        batch = [mRequest for mRequest in toInstall if (mRequest.version == '') == upgrade]
+        if len(batch) == 0:
+            continue
+        pipOptions = manifestOptions + (['--upgrade'] if upgrade else [])
+        logger.info('Installing: %s', ' '.join(mRequest.request for mRequest in batch))
+        installed = installBatch(batch, pipOptions, venvFiles)
+        for mRequest in batch:
+            if mRequest in installed:
+                mRequest.resultCode = 1
+            elif mRequest.installedVersion not in ['Built_in','None']:
+                mRequest.resultCode = 4
             else:
-                resultCode = 3
+                mRequest.resultCode = 3
 
+    if any(mRequest.resultCode == 1 for mRequest in mRequests):
+        compileModules(venvFiles)
+
+    # Get the new versions
+    updatedVersions = getInstalledVersions([mRequest.name for mRequest in mRequests if mRequest.resultCode == 1], venvFiles)
+
+    for mRequest in mRequests:
         # Exit the program with appropriate log entries
-        if resultCode == 0:
-            sList.append('Module "' + mRequested + '" is already installed')
-        elif resultCode == 1:
-            sList.append('Module "' + mName + '" was installed or updated to version ' +  getInstalledVersion(mName, envPath))
-        elif resultCode == 2:
-            sList.append('Module "' + mName + '" is a built-in.')
-        elif resultCode == 3:
-            fList.append('Module "' + mRequested + '"')
-        elif resultCode == 4:
-            sList.append('Module "' + mName + '" was not updated from version ' + installedVersion)
-        else:
+        if mRequest.resultCode not in RESULT_MESSAGES:
             logger.info('An unexpected error occured')
             sys.exit(1)
+        message = RESULT_MESSAGES[mRequest.resultCode].format(name=mRequest.name, request=mRequest.request,
+                                                              installed=mRequest.installedVersion,
+                                                              updated=updatedVersions.get(mRequest.name, ''))
+        if mRequest.resultCode == 3:
+            fList.append(message)
+        else:
+            sList.append(message)
 
     return sList, fList
 
+def reportResults(sList, fList):
+    # One log call per section
+    if len(sList) > 0:
+        logger.info('\n'.join(['-----------------------------------------------',
+                               'The following modules were installed or updated:'] + sList))
+
+    if len(fList) > 0:
+        logger.info('\n'.join(['!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!',
+                               'The following modules could not be installed:'] + fList +
+                              ['!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!']))
+        return
+
+    logger.info('\n'.join(['---------------------------------------',
+                           'All modules were successfully installed',
+                           '---------------------------------------']))
+
 def main(progName):
     #  Set up logging so journalc can be used
     createLogger(progName)
     logger.info('---------------------------------------------------')
-    logger.info(os.path.basename(sys.argv[0]) + ' is attempting to install python modules')
+    logger.info('%s is attempting to install python modules', os.path.basename(sys.argv[0]))
 
     #  Validate that the call was well formed and get the arguments
     manifestFile, pluginPath = validateParams()
     venvPath = os.path.normpath(os.path.join(pluginPath,VENV_FOLDER))
+    venvFiles = getVenvFiles(venvPath)
+
+    #  Nothing to do if this manifest was already installed into the venv
+    manifest = readManifest(manifestFile)
+    installKey = getInstallKey(manifest, venvFiles['python'])
+    installCache = readInstallCache(venvFiles)
+    if installCache.get('key') == installKey and os.path.isfile(venvFiles['python']):
+        # Make sure nothing was changed in the venv since
+        siteStamp = getSiteStamp(venvFiles)
+        unchanged = siteStamp == installCache.get('siteStamp')
+        if not unchanged: # Something may have changed - ask pip
+            createVenvFiles(venvFiles)
+            unchanged = getPipList(venvFiles) == installCache['pipList']
+            if unchanged: # Check without pip next time
+                installCache['siteStamp'] = siteStamp
+                writeInstallCache(venvFiles, installCache)
+        if unchanged:
+            logger.info('Manifest is unchanged since the last install')
+            reportResults(installCache['results'], [])
+            sys.exit(0)
+
+    # parse the manifestfile - only needed if something may be installed
+    # a bad manifest exits before the venv is touched
+    moduleList = getModuleList(manifestFile, manifest)
 
     #  Create virtual environment
-    createPythonEnv(venvPath)
-
-    # parse the manifestfile
-    moduleList = getModuleList(manifestFile)
+    createPythonEnv(venvFiles)
+    installKey = getInstallKey(manifest, venvFiles['python']) # The venv python may not have existed before
+    writeInstallCache(venvFiles, {})
+    createVenvFiles(venvFiles)
 
     # Install the modules
     successList = []
     failList = []
 
-    successList, failList = installModules(moduleList,venvPath)
-
-    if len(successList) > 0:
-        logger.info('-----------------------------------------------')
-        logger.info('The following modules were installed or updated:')
-        for entry in successList:
-            logger.info(entry)
+    successList, failList = installModules(moduleList,venvFiles)
 
+    reportResults(successList, failList)
     if len(failList) > 0:
-        logger.info('!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!')
-        logger.info('The following modules could not be installed:')
-        for entry in failList:
-            logger.info(entry)
-        logger.info('!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!')
         sys.exit(1)
 
-    logger.info('---------------------------------------')
-    logger.info('All modules were successfully installed')
-    logger.info('---------------------------------------')
+    writeInstallCache(venvFiles, {'key': installKey, 'siteStamp': getSiteStamp(venvFiles), 'pipList': getPipList(venvFiles), 'results': successList})
 if __name__ == "__main__":  # Do not run anything below if the file is imported by another program
     programName = sys.argv[0]
     main(programName)